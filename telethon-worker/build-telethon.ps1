@@ -33,7 +33,7 @@ if ($Clean -or (Test-Path (Join-Path $ScriptDir "dist"))) {
 
 python -m pip install --upgrade pip | Out-Null
 # python-socks is required for SOCKS5/SOCKS4/HTTP proxy support.
-python -m pip install telethon pyinstaller cryptg python-socks | Out-Null
+python -m pip install telethon pyinstaller cryptg python-socks orjson | Out-Null
 
 $DistDir = if ($OutputDir -ne "") { $OutputDir } else { Join-Path $ScriptDir "dist" }
 
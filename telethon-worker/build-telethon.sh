@@ -42,8 +42,11 @@ python3 -m pip install --upgrade pip --break-system-packages >/dev/null 2>&1 ||
 # python-socks is required for SOCKS5/SOCKS4/HTTP proxy support.
 # cryptg is an optional native speedup; it has no universal2 wheel, so a
 # cross-arch (PYINSTALLER_TARGET_ARCH) build omits it and Telethon falls back to
-# its pure-Python crypto. All other deps are pure Python.
-PKGS="telethon pyinstaller python-socks"
+# its pure-Python crypto. orjson and uvloop ship universal2 wheels; both are
+# optional speedups too (the worker falls back to stdlib json and the default
+# asyncio loop without them). uvloop has no Windows build, so only this script
+# installs it.
+PKGS="telethon pyinstaller python-socks orjson uvloop"
 if [ -z "${PYINSTALLER_TARGET_ARCH:-}" ]; then
   PKGS="$PKGS cryptg"
 fi
@@ -1,14 +1,27 @@
 #!/usr/bin/env python3
 import asyncio
+import base64
 import contextlib
+import functools
 import json
+import os
+import stat
 import sys
+import time
 import traceback
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, Deque
 from telethon import TelegramClient, events, errors
 from telethon.errors import SessionPasswordNeededError
 
+try:
+    # Optional native JSON encoder. It returns UTF-8 bytes directly, skipping the
+    # intermediate str that json.dumps builds for every response and event.
+    import orjson
+except ImportError:
+    orjson = None
+
 # Realistic default connection identity. Without this, Telethon reports the
 # device as "Telethon", which is a trivial fingerprint for a userbot. These are
 # overridden per-install by the config passed on argv.
@@ -128,31 +141,218 @@ class WorkerState:
     # Guards lazy client creation so concurrently-dispatched commands don't each
     # build their own TelegramClient. Initialized in main() (needs a running loop).
     client_lock: Optional[asyncio.Lock] = None
+    # Serializes the login steps, which read and mutate phone/authorized/user
+    # across awaits. Initialized in main() alongside client_lock.
+    auth_lock: Optional[asyncio.Lock] = None
+    # chat_id -> resolved InputPeer, most recently used last. Bounded by
+    # PEER_CACHE_SIZE; see resolve_peer().
+    peer_cache: "OrderedDict[int, Any]" = field(default_factory=OrderedDict)
+    # Last auth_state() snapshot. Shared by every response that reports it, so
+    # it must never be mutated; reset it to None whenever phone, authorized or
+    # user changes.
+    auth_cache: Optional[Dict[str, Any]] = None
 
 
-async def write_response(payload: Dict[str, Any]) -> None:
-    sys.stdout.write(json.dumps(payload) + "\n")
-    sys.stdout.flush()
+# Max chats whose resolved InputPeer is kept on WorkerState.
+PEER_CACHE_SIZE = 256
+
+# Groups per chunk frame when list_groups is asked to stream its results.
+GROUP_CHUNK_SIZE = 50
+
+# Commands that drive the login flow and must not interleave with each other.
+AUTH_COMMANDS = frozenset({"send_phone", "send_code", "send_password"})
+
+
+def _dumps(payload: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode("utf-8")
+
+
+# StreamReader limit for stdin: the longest request line accepted (up from the
+# 64 KiB default), and half the buffered input at which reading from the pipe
+# pauses, so up to 2 MiB of unread commands can be buffered.
+STDIN_READ_LIMIT = 1 << 20
 
+# Non-blocking stdout stream, set up by open_stdio() when the loop can wrap the
+# std pipes. None means frames go straight to the blocking sys.stdout buffer.
+_stdout_writer: Optional[asyncio.StreamWriter] = None
 
-async def enqueue_event(queue: asyncio.Queue, payload: Dict[str, Any]) -> None:
+
+def _is_stream_fd(stream) -> bool:
+    """True if stream is a pipe, socket or tty that a loop pipe transport accepts."""
     try:
-        queue.put_nowait(payload)
-    except asyncio.QueueFull:
-        # Drop oldest event to prevent unbounded growth
-        try:
-            queue.get_nowait()
-        except asyncio.QueueEmpty:
-            pass
-        queue.put_nowait(payload)
+        fd = stream.fileno()
+        mode = os.fstat(fd).st_mode
+    except (OSError, ValueError):
+        return False
+    if stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode):
+        return True
+    # Only ttys among character devices: /dev/null can't be polled (epoll
+    # rejects it), which aborts uvloop and hangs the stdlib loop.
+    return stat.S_ISCHR(mode) and os.isatty(fd)
+
+
+async def open_stdio(loop: asyncio.AbstractEventLoop) -> Optional[asyncio.StreamReader]:
+    """Attach stdin/stdout to the event loop as non-blocking streams.
+
+    Returns the stdin reader, or None when the loop can't wrap stdin (Windows'
+    proactor loop needs overlapped pipes; regular files are not streams), in
+    which case the caller falls back to blocking reads on the executor.
+    """
+    global _stdout_writer
+    # Check the fd type up front: the stdlib loop rejects a regular file with
+    # ValueError, but uvloop aborts the process instead.
+    if sys.platform == "win32" or not _is_stream_fd(sys.stdin):
+        return None
+    reader = asyncio.StreamReader(limit=STDIN_READ_LIMIT)
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except (OSError, ValueError, NotImplementedError):
+        return None
+    if not _is_stream_fd(sys.stdout):
+        # stdout redirected to a file: keep the blocking writes.
+        return reader
+    try:
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, sys.stdout
+        )
+    except (OSError, ValueError, NotImplementedError):
+        return reader
+    _stdout_writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader
+
+
+async def close_stdio() -> None:
+    """Wait for buffered stdout frames to reach the pipe before exiting."""
+    writer = _stdout_writer
+    if writer is None:
+        return
+    # With a zero high-water mark drain() only returns once the buffer is empty.
+    writer.transport.set_write_buffer_limits(0)
+    with contextlib.suppress(ConnectionError):
+        await writer.drain()
+
+
+async def _read_line(
+    reader: Optional[asyncio.StreamReader], loop: asyncio.AbstractEventLoop
+) -> Optional[bytes]:
+    """Read one request line; returns b"" on EOF and None for an oversized line."""
+    if reader is None:
+        # Read raw bytes, like the stream path: a text read would decode (and
+        # could fail on) bytes the JSON parser is about to reject anyway.
+        return await loop.run_in_executor(None, sys.stdin.buffer.readline)
+    try:
+        return await reader.readline()
+    except ValueError:
+        # Line exceeded the reader limit; the reader has already discarded it.
+        sys.stderr.write("[telethon-worker] Request line too long; dropped.\n")
+        sys.stderr.flush()
+        return None
+
+
+async def _write_frames(fragments: List[bytes]) -> None:
+    """Hand fragments to stdout as-is (no joined copy) and flush once."""
+    writer = _stdout_writer
+    if writer is not None:
+        writer.writelines(fragments)
+        await writer.drain()
+        return
+    out = sys.stdout.buffer
+    out.writelines(fragments)
+    out.flush()
+
+
+def _loads(line: bytes) -> Any:
+    # Both parsers accept the raw line: surrounding whitespace, including the
+    # trailing newline, is valid JSON, so no strip() copy is needed. Every
+    # failure is a ValueError: JSONDecodeError from either parser, or
+    # UnicodeDecodeError from json.loads on a non-UTF-8 line.
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+async def write_response(payload: Dict[str, Any]) -> None:
+    await _write_frames([_dumps(payload), b"\n"])
+
+
+# Constant framing around each encoded event, so events are written as
+# {"event": <event>} without building a wrapper dict per event.
+_EVENT_PREFIX = b'{"event":'
+_EVENT_SUFFIX = b"}\n"
+
+
+async def write_events(events: List[Dict[str, Any]]) -> None:
+    """Write several event frames with a single write + flush."""
+    fragments: List[bytes] = []
+    for event in events:
+        fragments.append(_EVENT_PREFIX)
+        fragments.append(_dumps(event))
+        fragments.append(_EVENT_SUFFIX)
+    await _write_frames(fragments)
+
+
+@dataclass
+class EventQueue:
+    """Bounded drop-oldest ring of pending events with a single consumer.
+
+    The deque's maxlen does the eviction on append, and the writer waits on
+    `ready` instead of a per-item Future as asyncio.Queue would use.
+    """
+    items: Deque[Dict[str, Any]]
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+async def enqueue_event(queue: EventQueue, payload: Dict[str, Any]) -> None:
+    items = queue.items
+    if len(items) == items.maxlen:
+        # The append below evicts the oldest event to prevent unbounded growth.
         sys.stderr.write("[telethon-worker] Event queue full; dropped oldest event.\n")
         sys.stderr.flush()
+    items.append(payload)
+    queue.ready.set()
 
 
-async def event_writer(queue: asyncio.Queue) -> None:
+async def event_writer(queue: EventQueue) -> None:
     while True:
-        event = await queue.get()
-        await write_response({"event": event})
+        await queue.ready.wait()
+        queue.ready.clear()
+        # Take everything queued so far so a burst of events costs one write
+        # and one flush instead of one per event.
+        batch = list(queue.items)
+        queue.items.clear()
+        if batch:
+            await write_events(batch)
+
+
+@dataclass
+class TracebackLimiter:
+    """Rate-limit full tracebacks for one failure site.
+
+    Every failure still gets a one-line stderr record. Only the traceback,
+    which walks the whole stack on the event-loop thread, is printed at most
+    once per cooldown window, so a tight failure loop (e.g. a revoked session
+    failing every command) can't eat the CPU.
+    """
+    cooldown: float = 10.0
+    last_traceback: float = float("-inf")
+
+    def report(self, summary: str) -> None:
+        """Report the exception currently being handled."""
+        sys.stderr.write(f"[telethon-worker] {summary}\n")
+        now = time.monotonic()
+        if now - self.last_traceback >= self.cooldown:
+            self.last_traceback = now
+            traceback.print_exc(file=sys.stderr)
+        sys.stderr.flush()
+
+
+# One limiter per command, so a burst of failing sends can't hide the
+# traceback of an unrelated login failure. Only known commands reach it.
+_command_failures: Dict[str, TracebackLimiter] = {}
+_button_failures = TracebackLimiter()
+_handler_failures = TracebackLimiter()
 
 
 def _build_message_payload(event_type: str, message) -> Dict[str, Any]:
@@ -165,10 +365,8 @@ def _build_message_payload(event_type: str, message) -> Dict[str, Any]:
     """
     try:
         buttons = _serialize_buttons(message)
-    except Exception:
-        traceback.print_exc(file=sys.stderr)
-        sys.stderr.write("[telethon-worker] Failed to serialize buttons; emitting with none.\n")
-        sys.stderr.flush()
+    except Exception as exc:
+        _button_failures.report(f"Failed to serialize buttons; emitting with none: {exc!r}")
         buttons = []
     return {
         "type": event_type,
@@ -183,32 +381,23 @@ def _build_message_payload(event_type: str, message) -> Dict[str, Any]:
     }
 
 
+def _button_dict(button) -> Dict[str, Any]:
+    data = getattr(button, "data", None)
+    if data is not None:
+        return {"text": button.text, "type": "callback", "data": data.hex(), "url": None}
+    url = getattr(button, "url", None)
+    if url:
+        return {"text": button.text, "type": "url", "data": None, "url": url}
+    # Reply keyboard button - just text
+    return {"text": button.text, "type": "text", "data": None, "url": None}
+
+
 def _serialize_buttons(message) -> List[List[Dict[str, Any]]]:
-    rows: List[List[Dict[str, Any]]] = []
-    if message.buttons:
-        for row in message.buttons:
-            row_items = []
-            for button in row:
-                btn_type = "unknown"
-                data = None
-                url = None
-                if hasattr(button, "data") and button.data is not None:
-                    btn_type = "callback"
-                    data = button.data.hex()
-                elif hasattr(button, "url") and button.url:
-                    btn_type = "url"
-                    url = button.url
-                else:
-                    # Reply keyboard button - just text
-                    btn_type = "text"
-                row_items.append({
-                    "text": button.text,
-                    "type": btn_type,
-                    "data": data,
-                    "url": url,
-                })
-            rows.append(row_items)
-    return rows
+    # `message.buttons` is a computed property; read it once.
+    rows = message.buttons
+    if not rows:
+        return []
+    return [[_button_dict(button) for button in row] for row in rows]
 
 
 def build_error(request_id: str, message: str) -> Dict[str, Any]:
@@ -223,7 +412,30 @@ def build_ok(request_id: str, payload: Optional[Dict[str, Any]] = None) -> Dict[
     return {"id": request_id, "ok": True, "payload": payload or {}}
 
 
+def build_chunk(request_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Partial result for a still-running request. It has no "ok" field, so
+    # callers that only wait for the final response skip it.
+    return {"id": request_id, "chunk": payload}
+
+
+def _user_dict(me) -> Dict[str, Any]:
+    return {
+        "id": me.id,
+        "first_name": me.first_name or "",
+        "last_name": me.last_name or "",
+        "phone": me.phone or "",
+    }
+
+
 def auth_state(state: WorkerState) -> Dict[str, Any]:
+    # Polled by the app on every `state` command; rebuilt only after a login
+    # step changes phone/authorized/user (each such site resets the cache).
+    if state.auth_cache is None:
+        state.auth_cache = _build_auth_state(state)
+    return state.auth_cache
+
+
+def _build_auth_state(state: WorkerState) -> Dict[str, Any]:
     if state.authorized and state.user:
         return {
             "state": "ready",
@@ -237,7 +449,33 @@ def auth_state(state: WorkerState) -> Dict[str, Any]:
     return {"state": "waiting_phone_number"}
 
 
-async def ensure_client(state: WorkerState, event_queue: asyncio.Queue) -> TelegramClient:
+async def _forward_message(event_type: str, queue: EventQueue, event) -> None:
+    try:
+        await enqueue_event(queue, _build_message_payload(event_type, event.message))
+    except Exception as exc:
+        # Never let a handler exception propagate — Telethon would
+        # silently swallow it and we'd lose visibility into the failure.
+        _handler_failures.report(f"Message event handler failed: {exc!r}")
+
+
+def register_event_handlers(client: TelegramClient, event_queue: EventQueue) -> None:
+    """Attach the message handlers to client, at most once per client.
+
+    A second registration would emit (and serialize) every message twice, so
+    the client is marked once its handlers are in place.
+    """
+    if getattr(client, "_qm_handlers", False):
+        return
+    client.add_event_handler(
+        functools.partial(_forward_message, "message", event_queue), events.NewMessage
+    )
+    client.add_event_handler(
+        functools.partial(_forward_message, "message_edited", event_queue), events.MessageEdited
+    )
+    client._qm_handlers = True
+
+
+async def ensure_client(state: WorkerState, event_queue: EventQueue) -> TelegramClient:
     if state.client:
         return state.client
 
@@ -271,204 +509,286 @@ async def ensure_client(state: WorkerState, event_queue: asyncio.Queue) -> Teleg
         if await client.is_user_authorized():
             await client.start()
 
-        @client.on(events.NewMessage)
-        async def on_new_message(event):
-            try:
-                await enqueue_event(event_queue, _build_message_payload("message", event.message))
-            except Exception:
-                # Never let a handler exception propagate — Telethon would
-                # silently swallow it and we'd lose visibility into the failure.
-                traceback.print_exc(file=sys.stderr)
-
-        @client.on(events.MessageEdited)
-        async def on_message_edited(event):
-            try:
-                await enqueue_event(
-                    event_queue, _build_message_payload("message_edited", event.message)
-                )
-            except Exception:
-                traceback.print_exc(file=sys.stderr)
+        register_event_handlers(client, event_queue)
 
         state.client = client
         state.authorized = await client.is_user_authorized()
-        if state.authorized:
-            me = await client.get_me()
-            state.user = {
-                "id": me.id,
-                "first_name": me.first_name or "",
-                "last_name": me.last_name or "",
-                "phone": me.phone or "",
-            }
+        if state.authorized and not state.user:
+            state.user = _user_dict(await client.get_me())
+        state.auth_cache = None
         return client
     finally:
         if lock is not None:
             lock.release()
 
 
-async def handle_command(state: WorkerState, request: Dict[str, Any], event_queue: asyncio.Queue) -> None:
-    request_id = request.get("id") or ""
-    command = request.get("command")
-    payload = request.get("payload") or {}
+async def resolve_peer(state: WorkerState, client: TelegramClient, chat_id: Any) -> Any:
+    """Return the InputPeer for chat_id, resolving it at most once per chat.
 
-    try:
-        if command == "state":
-            await write_response(build_ok(request_id, auth_state(state)))
-            return
+    Automation keeps sending to the same few chats, so clicks and replies reuse
+    the cached peer instead of going through get_input_entity() every time.
+    """
+    cid = int(chat_id)
+    cache = state.peer_cache
+    peer = cache.get(cid)
+    if peer is not None:
+        cache.move_to_end(cid)
+        return peer
+    peer = await client.get_input_entity(cid)
+    cache[cid] = peer
+    if len(cache) > PEER_CACHE_SIZE:
+        cache.popitem(last=False)
+    return peer
+
+
+async def _record_sign_in(state: WorkerState, client: TelegramClient, me) -> None:
+    """Update auth state after a successful sign_in().
+
+    sign_in() already returns the logged-in User, so get_me() is only a
+    fallback for when it didn't.
+    """
+    state.authorized = await client.is_user_authorized()
+    if state.authorized and not state.user:
+        state.user = _user_dict(me or await client.get_me())
+    state.auth_cache = None
 
-        client = await ensure_client(state, event_queue)
-
-        if command == "send_phone":
-            phone = payload.get("phone")
-            if not phone:
-                await write_response(build_error(request_id, "Phone number required"))
-                return
-            try:
-                await client.send_code_request(phone)
-            except errors.FloodWaitError as e:
-                await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
-                return
-            state.phone = phone
-            await write_response(build_ok(request_id, auth_state(state)))
-            return
 
-        if command == "send_code":
-            code = payload.get("code")
-            if not code or not state.phone:
-                await write_response(build_error(request_id, "Code and phone required"))
-                return
-            try:
-                await client.sign_in(state.phone, code)
-            except SessionPasswordNeededError:
-                # Get password hint from Telegram
-                password_info = await client.get_password()
-                hint = password_info.hint if password_info and password_info.hint else ""
-                await write_response(build_ok(request_id, {"state": "waiting_password", "password_hint": hint}))
-                return
-            except errors.FloodWaitError as e:
-                await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
-                return
-            state.authorized = await client.is_user_authorized()
-            if state.authorized:
-                me = await client.get_me()
-                state.user = {
-                    "id": me.id,
-                    "first_name": me.first_name or "",
-                    "last_name": me.last_name or "",
-                    "phone": me.phone or "",
-                }
-            await write_response(build_ok(request_id, auth_state(state)))
-            return
+async def _cmd_state(state: WorkerState, request_id: str, payload: Dict[str, Any], client: Optional[TelegramClient]) -> None:
+    await write_response(build_ok(request_id, auth_state(state)))
 
-        if command == "send_password":
-            password = payload.get("password")
-            if not password:
-                await write_response(build_error(request_id, "Password required"))
-                return
-            try:
-                await client.sign_in(password=password)
-            except errors.FloodWaitError as e:
-                await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
-                return
-            state.authorized = await client.is_user_authorized()
-            if state.authorized:
-                me = await client.get_me()
-                state.user = {
-                    "id": me.id,
-                    "first_name": me.first_name or "",
-                    "last_name": me.last_name or "",
-                    "phone": me.phone or "",
-                }
-            await write_response(build_ok(request_id, auth_state(state)))
-            return
 
-        if command == "list_groups":
+async def _cmd_send_phone(state: WorkerState, request_id: str, payload: Dict[str, Any], client: TelegramClient) -> None:
+    phone = payload.get("phone")
+    if not phone:
+        await write_response(build_error(request_id, "Phone number required"))
+        return
+    try:
+        await client.send_code_request(phone)
+    except errors.FloodWaitError as e:
+        await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
+        return
+    state.phone = phone
+    state.auth_cache = None
+    await write_response(build_ok(request_id, auth_state(state)))
+
+
+async def _cmd_send_code(state: WorkerState, request_id: str, payload: Dict[str, Any], client: TelegramClient) -> None:
+    code = payload.get("code")
+    if not code or not state.phone:
+        await write_response(build_error(request_id, "Code and phone required"))
+        return
+    try:
+        me = await client.sign_in(state.phone, code)
+    except SessionPasswordNeededError:
+        # Get password hint from Telegram
+        password_info = await client.get_password()
+        hint = password_info.hint if password_info and password_info.hint else ""
+        await write_response(build_ok(request_id, {"state": "waiting_password", "password_hint": hint}))
+        return
+    except errors.FloodWaitError as e:
+        await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
+        return
+    await _record_sign_in(state, client, me)
+    await write_response(build_ok(request_id, auth_state(state)))
+
+
+async def _cmd_send_password(state: WorkerState, request_id: str, payload: Dict[str, Any], client: TelegramClient) -> None:
+    password = payload.get("password")
+    if not password:
+        await write_response(build_error(request_id, "Password required"))
+        return
+    try:
+        me = await client.sign_in(password=password)
+    except errors.FloodWaitError as e:
+        await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
+        return
+    await _record_sign_in(state, client, me)
+    await write_response(build_ok(request_id, auth_state(state)))
+
+
+def _group_dict(dialog) -> Dict[str, Any]:
+    group_type = "supergroup" if getattr(dialog.entity, "megagroup", False) else "group"
+    return {"id": dialog.id, "title": dialog.name, "group_type": group_type}
+
+
+async def _cmd_list_groups(state: WorkerState, request_id: str, payload: Dict[str, Any], client: TelegramClient) -> None:
+    # By default every group goes back in one response. A caller that sends
+    # {"stream": true} instead gets chunk frames of GROUP_CHUNK_SIZE groups while
+    # the dialogs are still being walked, then a final ok with just the count.
+    # An optional positive "limit" caps the number of groups returned, so the
+    # dialog walk stops as soon as enough have been found.
+    stream = bool(payload.get("stream"))
+    limit = payload.get("limit")
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0:
+        limit = None
+    groups = []
+    count = 0
+    # ignore_migrated drops the dead basic-group half of every group that was
+    # upgraded to a supergroup; it would otherwise be listed next to its successor.
+    async for dialog in client.iter_dialogs(ignore_migrated=True):
+        if not dialog.is_group:
+            continue
+        groups.append(_group_dict(dialog))
+        count += 1
+        if stream and len(groups) >= GROUP_CHUNK_SIZE:
+            await write_response(build_chunk(request_id, {"groups": groups}))
             groups = []
-            async for dialog in client.iter_dialogs():
-                entity = dialog.entity
-                if dialog.is_group:
-                    group_type = "supergroup" if getattr(entity, "megagroup", False) else "group"
-                    groups.append({
-                        "id": dialog.id,
-                        "title": dialog.name,
-                        "group_type": group_type,
-                    })
-            await write_response(build_ok(request_id, {"groups": groups}))
-            return
+        if limit is not None and count >= limit:
+            break
+    if not stream:
+        await write_response(build_ok(request_id, {"groups": groups}))
+        return
+    if groups:
+        await write_response(build_chunk(request_id, {"groups": groups}))
+    await write_response(build_ok(request_id, {"count": count}))
+
+
+async def _cmd_send_message(state: WorkerState, request_id: str, payload: Dict[str, Any], client: TelegramClient) -> None:
+    chat_id = payload.get("chat_id")
+    text = payload.get("text")
+    if chat_id is None or not text:
+        await write_response(build_error(request_id, "chat_id and text required"))
+        return
+    try:
+        peer = await resolve_peer(state, client, chat_id)
+        await client.send_message(peer, text)
+    except errors.FloodWaitError as e:
+        await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
+        return
+    except errors.SlowModeWaitError as e:
+        await write_response(build_error_with_payload(request_id, "SLOWMODE_WAIT", {"code": "SLOWMODE_WAIT", "seconds": e.seconds}))
+        return
+    except (errors.AuthKeyDuplicatedError, errors.SessionRevokedError) as e:
+        await write_response(build_error_with_payload(request_id, "AUTH_REVOKED", {"code": "AUTH_REVOKED", "message": str(e)}))
+        return
+    await write_response(build_ok(request_id, {}))
+
+
+async def _cmd_click_button(state: WorkerState, request_id: str, payload: Dict[str, Any], client: TelegramClient) -> None:
+    chat_id = payload.get("chat_id")
+    message_id = payload.get("message_id")
+    # Callback data arrives hex-encoded in "data" (as emitted in button
+    # payloads) or base64-encoded in "data_b64", which is preferred if both
+    # are present and is a third shorter on the wire.
+    data_b64 = payload.get("data_b64")
+    data = payload.get("data")
+    text = payload.get("text")
+
+    if chat_id is None or message_id is None:
+        await write_response(build_error(request_id, "chat_id and message_id required"))
+        return
 
-        if command == "send_message":
-            chat_id = payload.get("chat_id")
-            text = payload.get("text")
-            if chat_id is None or not text:
-                await write_response(build_error(request_id, "chat_id and text required"))
-                return
-            try:
-                await client.send_message(int(chat_id), text)
-            except errors.FloodWaitError as e:
-                await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
-                return
-            except errors.SlowModeWaitError as e:
-                await write_response(build_error_with_payload(request_id, "SLOWMODE_WAIT", {"code": "SLOWMODE_WAIT", "seconds": e.seconds}))
-                return
-            except (errors.AuthKeyDuplicatedError, errors.SessionRevokedError) as e:
-                await write_response(build_error_with_payload(request_id, "AUTH_REVOKED", {"code": "AUTH_REVOKED", "message": str(e)}))
-                return
-            await write_response(build_ok(request_id, {}))
+    try:
+        # Handle callback buttons (data present) vs text buttons.
+        # Use `is not None` so an empty-but-present data string is still
+        # treated as a callback rather than silently falling through.
+        if data_b64 is not None or data is not None:
+            raw = base64.b64decode(data_b64, validate=True) if data_b64 is not None else bytes.fromhex(data)
+            peer = await resolve_peer(state, client, chat_id)
+            await client.send_callback(peer, int(message_id), raw)
+        elif text:
+            # Reply keyboard button - send text as message
+            peer = await resolve_peer(state, client, chat_id)
+            await client.send_message(peer, text)
+        else:
+            await write_response(build_error(request_id, "Either data or text must be provided"))
             return
+    except errors.FloodWaitError as e:
+        await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
+        return
+    except errors.SlowModeWaitError as e:
+        await write_response(build_error_with_payload(request_id, "SLOWMODE_WAIT", {"code": "SLOWMODE_WAIT", "seconds": e.seconds}))
+        return
+    except (errors.AuthKeyDuplicatedError, errors.SessionRevokedError) as e:
+        await write_response(build_error_with_payload(request_id, "AUTH_REVOKED", {"code": "AUTH_REVOKED", "message": str(e)}))
+        return
 
-        if command == "click_button":
-            chat_id = payload.get("chat_id")
-            message_id = payload.get("message_id")
-            data = payload.get("data")
-            text = payload.get("text")
-            
-            if chat_id is None or message_id is None:
-                await write_response(build_error(request_id, "chat_id and message_id required"))
-                return
-            
-            try:
-                # Handle callback buttons (data present) vs text buttons.
-                # Use `is not None` so an empty-but-present data string is still
-                # treated as a callback rather than silently falling through.
-                if data is not None:
-                    await client.send_callback(int(chat_id), int(message_id), bytes.fromhex(data))
-                elif text:
-                    # Reply keyboard button - send text as message
-                    await client.send_message(int(chat_id), text)
-                else:
-                    await write_response(build_error(request_id, "Either data or text must be provided"))
-                    return
-            except errors.FloodWaitError as e:
-                await write_response(build_error_with_payload(request_id, "FLOOD_WAIT", {"code": "FLOOD_WAIT", "seconds": e.seconds}))
-                return
-            except errors.SlowModeWaitError as e:
-                await write_response(build_error_with_payload(request_id, "SLOWMODE_WAIT", {"code": "SLOWMODE_WAIT", "seconds": e.seconds}))
-                return
-            except (errors.AuthKeyDuplicatedError, errors.SessionRevokedError) as e:
-                await write_response(build_error_with_payload(request_id, "AUTH_REVOKED", {"code": "AUTH_REVOKED", "message": str(e)}))
-                return
-            
-            await write_response(build_ok(request_id, {}))
-            return
+    await write_response(build_ok(request_id, {}))
 
-        if command == "start_updates":
-            await write_response(build_ok(request_id, {"status": "listening"}))
-            return
 
-        if command == "shutdown":
-            if state.client:
-                await state.client.disconnect()
-            await write_response(build_ok(request_id, {}))
-            # Signal the main loop to exit so the process terminates promptly
-            # instead of waiting to be force-killed.
-            state.should_exit = True
-            return
+async def _cmd_start_updates(state: WorkerState, request_id: str, payload: Dict[str, Any], client: TelegramClient) -> None:
+    await write_response(build_ok(request_id, {"status": "listening"}))
+
+
+async def _cmd_shutdown(state: WorkerState, request_id: str, payload: Dict[str, Any], client: Optional[TelegramClient]) -> None:
+    # Runs without ensure_client: there is nothing to disconnect if no client
+    # was ever created. Take client_lock first, though, so a client that a
+    # concurrent command (typically start_updates) is still connecting is
+    # waited for and closed rather than left connected at exit.
+    lock = state.client_lock
+    if lock is not None:
+        await lock.acquire()
+    try:
+        if state.client:
+            await state.client.disconnect()
+    finally:
+        if lock is not None:
+            lock.release()
+    await write_response(build_ok(request_id, {}))
+    # Signal the main loop to exit so the process terminates promptly
+    # instead of waiting to be force-killed.
+    state.should_exit = True
+
+
+CommandHandler = Callable[[WorkerState, str, Dict[str, Any], Optional[TelegramClient]], Awaitable[None]]
 
+
+@dataclass(frozen=True)
+class Command:
+    handler: CommandHandler
+    # False for commands answered from WorkerState alone, which must not create
+    # or connect a client just to run. start_updates does need one: it is the
+    # first command the app sends, and connecting is what starts the updates.
+    needs_client: bool = True
+
+
+COMMANDS: Dict[str, Command] = {
+    "state": Command(_cmd_state, needs_client=False),
+    "send_phone": Command(_cmd_send_phone),
+    "send_code": Command(_cmd_send_code),
+    "send_password": Command(_cmd_send_password),
+    "list_groups": Command(_cmd_list_groups),
+    "send_message": Command(_cmd_send_message),
+    "click_button": Command(_cmd_click_button),
+    "start_updates": Command(_cmd_start_updates),
+    "shutdown": Command(_cmd_shutdown, needs_client=False),
+}
+
+
+async def handle_command(state: WorkerState, request: Dict[str, Any], event_queue: EventQueue) -> None:
+    request_id = request.get("id") or ""
+    command = request.get("command")
+    payload = request.get("payload") or {}
+
+    spec = COMMANDS.get(command) if isinstance(command, str) else None
+    if spec is None:
         await write_response(build_error(request_id, f"Unknown command: {command}"))
+        return
+
+    try:
+        client = await ensure_client(state, event_queue) if spec.needs_client else state.client
+        await spec.handler(state, request_id, payload, client)
     except Exception as exc:
-        traceback.print_exc(file=sys.stderr)
+        limiter = _command_failures.setdefault(command, TracebackLimiter())
+        limiter.report(f"Command {command} failed: {exc!r}")
         await write_response(build_error(request_id, str(exc)))
 
 
+async def run_command(
+    state: WorkerState,
+    request: Dict[str, Any],
+    event_queue: EventQueue,
+    limit: asyncio.Semaphore,
+) -> None:
+    """Run one dispatched command under the concurrency limit."""
+    async with limit:
+        if request.get("command") in AUTH_COMMANDS and state.auth_lock is not None:
+            async with state.auth_lock:
+                await handle_command(state, request, event_queue)
+        else:
+            await handle_command(state, request, event_queue)
+
+
 async def main() -> None:
     if len(sys.argv) < 4:
         sys.stderr.write("Usage: telethon_worker.py <api_id> <api_hash> <session_path> [config_json]\n")
@@ -487,9 +807,10 @@ async def main() -> None:
         conn_config=conn_config,
     )
     state.client_lock = asyncio.Lock()
+    state.auth_lock = asyncio.Lock()
 
     EVENT_QUEUE_SIZE = 200
-    event_queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+    event_queue = EventQueue(deque(maxlen=EVENT_QUEUE_SIZE))
     event_task = asyncio.create_task(event_writer(event_queue))
 
     # Track in-flight command tasks. Commands are dispatched concurrently so a
@@ -497,24 +818,39 @@ async def main() -> None:
     # and handling the next stdin line, which would otherwise let the Rust caller
     # hit its request timeout while the worker is still busy.
     pending: "set[asyncio.Task]" = set()
+    # Bound how many commands run at once so a flood of requests can't pile up
+    # unbounded Telethon calls.
+    MAX_CONCURRENT_COMMANDS = 16
+    command_limit = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
 
     loop = asyncio.get_running_loop()
+    stdin_reader = await open_stdio(loop)
     while not state.should_exit:
-        line = await loop.run_in_executor(None, sys.stdin.readline)
+        line = await _read_line(stdin_reader, loop)
+        if line is None:
+            continue
         if not line:
             break
         try:
-            request = json.loads(line.strip())
-        except json.JSONDecodeError:
+            request = _loads(line)
+        except ValueError:
+            continue
+        if not isinstance(request, dict):
             continue
 
-        task = asyncio.create_task(handle_command(state, request, event_queue))
+        # Shutdown must take effect deterministically: run it to completion
+        # (disconnect + ack) and then stop reading. It bypasses the concurrency
+        # limit, but is still started as a task so commands read before it start
+        # first rather than running against a disconnected client.
+        is_shutdown = request.get("command") == "shutdown"
+        if is_shutdown:
+            task = asyncio.create_task(handle_command(state, request, event_queue))
+        else:
+            task = asyncio.create_task(run_command(state, request, event_queue, command_limit))
         pending.add(task)
         task.add_done_callback(pending.discard)
 
-        # Shutdown must take effect deterministically: let it run to completion
-        # (disconnect + ack) and then stop reading.
-        if request.get("command") == "shutdown":
+        if is_shutdown:
             await task
             break
 
@@ -525,7 +861,22 @@ async def main() -> None:
     event_task.cancel()
     with contextlib.suppress(asyncio.CancelledError):
         await event_task
+    await close_stdio()
+
+
+def install_event_loop_policy() -> None:
+    """Use uvloop's libuv-based event loop when it is installed.
+
+    It is optional: there are no Windows builds, and the stdlib loop works
+    everywhere.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return
+    uvloop.install()
 
 
 if __name__ == "__main__":
+    install_event_loop_policy()
     asyncio.run(main())